@@ -1,52 +1,186 @@
+import asyncio
 import streamlit as st
-from groq import Groq
 import os
 import re
-from dotenv import load_dotenv
-
-# Load environment variables
-# Try Streamlit secrets first (for deployment), then fall back to .env.local
-try:
-    import streamlit as st
-    # Use Streamlit secrets if available (deployment)
-    if hasattr(st, 'secrets') and st.secrets:
-        for key, value in st.secrets.items():
-            os.environ[key] = str(value)
-except:
-    pass
-
-# Fallback to .env.local for local development
-load_dotenv(dotenv_path=".env.local")
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import astuple, dataclass
+
+@st.cache_resource(show_spinner=False)
+def load_environment():
+    """Load environment variables once per process, not on every rerun"""
+    from dotenv import load_dotenv
+
+    # Try Streamlit secrets first (for deployment), then fall back to .env.local
+    try:
+        os.environ.update({key: str(value) for key, value in st.secrets.items()})
+    except Exception:
+        pass
+
+    # Fallback to .env.local for local development
+    load_dotenv(dotenv_path=".env.local")
+
+load_environment()
+
+# First entry of a numbered list, e.g. "1. Kyoto, Japan - ..." or "1. **Kyoto**: ..."
+_CITY_RE = re.compile(r'^[\s*#]*\d+\.[\s*]*([^,\-:\n*]{3,}?)[\s*]*(?:[,\-:]|$)', re.M)
+
+_SURROGATE_RE = re.compile('[\ud800-\udfff]')
 
 # Function to clean invalid surrogate characters (Windows terminal issue)
 def clean_surrogates(text):
     if isinstance(text, str):
-        return re.sub(r'[\ud800-\udfff]', '', text)
+        # Pure-ASCII text (the usual LLM output) cannot contain surrogates
+        if text.isascii():
+            return text
+        return _SURROGATE_RE.sub('', text)
     return text
 
-def get_groq_response(prompt, client):
-    """Get response from Groq API"""
+GROQ_MODEL = "llama3-8b-8192"
+GROQ_TEMPERATURE = 0.7
+
+@dataclass(frozen=True, slots=True)
+class TripInputs:
+    """Sidebar preferences for one plan; immutable so it can key caches and saved plans"""
+    travel_type: str
+    interests: tuple
+    season: str
+    duration: int
+    budget: str
+
+    @property
+    def interests_text(self):
+        return ', '.join(self.interests)
+
+# Cap on simultaneous Groq requests per plan (free tier rate limits)
+MAX_CONCURRENT_REQUESTS = 3
+
+# Sidebar options and page copy, built once at import rather than on every rerun
+TRAVEL_TYPES = ("Leisure", "Business", "Adventure", "Cultural", "Relaxation", "Family Trip")
+INTERESTS = ("History", "Food", "Nature", "Art", "Shopping", "Nightlife", "Beaches", "Mountains", "Museums", "Sports", "Music", "Wildlife")
+SEASONS = ("Summer", "Winter", "Spring", "Fall", "Any")
+BUDGETS = ("Budget (Rs500-Rs1500)", "Mid-range (Rs1500-Rs4000)", "Luxury (Rs4000+)")
+
+# (tab label, header, plan key) for each result tab, in display order
+RESULT_TABS = (
+    ("Cities", "🌆 Recommended Cities", "cities"),
+    ("Research", "🗺 Destination Insights", "research"),
+    ("Itinerary", "📅 Detailed Itinerary", "itinerary"),
+    ("Budget", "💸 Budget Breakdown", "budget"),
+)
+MARKDOWN_WRAP = '<div style="font-size: 16px;">%s</div>'
+
+WELCOME_MD = """
+Welcome to your AI-powered travel planner! Tell us your preferences, and our AI
+will craft a personalized itinerary and budget for your next adventure.
+"""
+
+# Identical prompts within this window (seconds) reuse the earlier response
+RESPONSE_CACHE_TTL = 3600
+RESPONSE_CACHE_MAX_ENTRIES = 256
+
+class StageError(str):
+    """Error text shown in place of a stage's output; never cached, and marks the plan incomplete"""
+
+class ResponseCache:
+    """Thread-safe LRU of recent LLM responses, keyed by (model, temperature, system prompt, prompt)"""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created, text = entry
+            if time.monotonic() - created > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return text
+
+    def set(self, key, text):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+def render_markdown(placeholder, text):
+    """Render LLM Markdown output into a Streamlit placeholder"""
+    placeholder.markdown(MARKDOWN_WRAP % clean_surrogates(text), unsafe_allow_html=True)
+
+@st.cache_resource(show_spinner=False)
+def get_groq_client():
+    """Create the Groq client once per process so its connection pool survives reruns"""
+    # Imported here so the page renders before the SDK (and httpx) load on a cold start
+    from groq import Groq
+
+    return Groq(api_key=os.getenv("GROQ_API_KEY"))
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache():
+    """Share one response cache between all sessions of the process"""
+    return ResponseCache(RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES)
+
+def traveler_profile(inputs):
+    """System prompt carrying the traveler preferences shared by every stage"""
+    return (
+        "You are a travel expert. The traveler preferences are: "
+        f"Travel Type: {inputs.travel_type}, Interests: {inputs.interests_text}, "
+        f"Season: {inputs.season}, Budget Range: {inputs.budget}, "
+        f"Duration: {inputs.duration} days."
+    )
+
+async def get_groq_response(prompt, system_prompt, client, placeholder, use_cache=True):
+    """Stream a response from Groq API into placeholder and return the full text"""
+    cache = get_response_cache()
+    cache_key = (GROQ_MODEL, GROQ_TEMPERATURE, system_prompt, prompt)
+    cached = cache.get(cache_key) if use_cache else None
+    if cached is not None:
+        render_markdown(placeholder, cached)
+        return cached
+
     try:
-        response = client.chat.completions.create(
-            model="llama3-8b-8192",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=2000
+        # The shared client is synchronous; blocking reads run in worker threads
+        stream = await asyncio.to_thread(
+            client.chat.completions.create,
+            model=GROQ_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=GROQ_TEMPERATURE,
+            max_tokens=2000,
+            stream=True
         )
-        return response.choices[0].message.content
+        try:
+            chunks = iter(stream)
+            text = ""
+            while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    text += chunk.choices[0].delta.content
+                    render_markdown(placeholder, text + "▌")
+        finally:
+            # Release the response even when stopped or failed mid-stream, so Groq stops
+            # generating and the connection goes back to the shared client's pool
+            stream.close()
+        cache.set(cache_key, text)
     except Exception as e:
-        return f"Error: {str(e)}"
+        text = StageError(f"Error: {str(e)}")
+    render_markdown(placeholder, text)
+    return text
 
-def generate_city_recommendations(inputs, client):
+async def generate_city_recommendations(inputs, client, placeholder, use_cache=True):
     """Generate city recommendations using Groq"""
-    prompt = f"""
-    As a travel expert, recommend 3 best cities to visit based on these preferences:
-    
-    Travel Type: {inputs['travel_type']}
-    Interests: {inputs['interests']}
-    Season: {inputs['season']}
-    Budget Range: {inputs['budget']}
-    Duration: {inputs['duration']} days
+    prompt = """
+    Recommend the 3 best cities to visit for this traveler's preferences.
     
     For each city, provide:
     1. City name and country
@@ -56,15 +190,12 @@ def generate_city_recommendations(inputs, client):
     
     Format as a numbered list with city names clearly stated.
     """
-    return get_groq_response(prompt, client)
+    return await get_groq_response(prompt, traveler_profile(inputs), client, placeholder, use_cache)
 
-def generate_destination_research(city, inputs, client):
+async def generate_destination_research(city, inputs, client, placeholder, use_cache=True):
     """Generate detailed destination research"""
     prompt = f"""
-    Provide comprehensive research about {city} for a traveler with these preferences:
-    Travel Type: {inputs['travel_type']}
-    Interests: {inputs['interests']}
-    Duration: {inputs['duration']} days
+    Provide comprehensive research about {city} for this traveler.
     
     Include:
     1. TOP 5 ATTRACTIONS: Must-visit places with brief descriptions and estimated time
@@ -77,15 +208,12 @@ def generate_destination_research(city, inputs, client):
     
     Make this practical and actionable for travelers.
     """
-    return get_groq_response(prompt, client)
+    return await get_groq_response(prompt, traveler_profile(inputs), client, placeholder, use_cache)
 
-def generate_itinerary(city, inputs, client):
+async def generate_itinerary(city, inputs, client, placeholder, use_cache=True):
     """Generate detailed itinerary"""
     prompt = f"""
-    Create a detailed {inputs['duration']}-day itinerary for {city} based on:
-    - Travel Type: {inputs['travel_type']}
-    - Interests: {inputs['interests']}
-    - Duration: {inputs['duration']} days
+    Create a detailed {inputs.duration}-day itinerary for {city} for this traveler.
     
     For each day, include:
     1. DAY NUMBER: Clearly state the day (e.g., 'Day 1: Arrival and City Exploration')
@@ -99,13 +227,13 @@ def generate_itinerary(city, inputs, client):
     
     Make activities geographically logical and account for travel time.
     """
-    return get_groq_response(prompt, client)
+    return await get_groq_response(prompt, traveler_profile(inputs), client, placeholder, use_cache)
 
-def generate_budget_plan(city, inputs, client):
+async def generate_budget_plan(city, inputs, client, placeholder, use_cache=True):
     """Generate budget breakdown"""
     prompt = f"""
-    Create a realistic budget plan for a {inputs['duration']}-day trip to {city} 
-    with a {inputs['budget']} budget.
+    Create a realistic budget plan for a {inputs.duration}-day trip to {city} 
+    with a {inputs.budget} budget.
     
     Break down costs for:
     1. ACCOMMODATION: Per night costs and total
@@ -123,27 +251,135 @@ def generate_budget_plan(city, inputs, client):
     
     Use local currency or USD with clear indication.
     """
-    return get_groq_response(prompt, client)
+    return await get_groq_response(prompt, traveler_profile(inputs), client, placeholder, use_cache)
+
+async def gather_limited(semaphore, *coros):
+    """Run coroutines concurrently, at most semaphore's value at a time"""
+    async def run(coro):
+        async with semaphore:
+            try:
+                return await coro
+            except Exception as e:
+                return e
+    # Errors come back as results, but Streamlit's stop/rerun signals (BaseException)
+    # still propagate, so asyncio.run cancels the remaining stages straight away
+    return await asyncio.gather(*(run(coro) for coro in coros))
+
+def create_result_tabs():
+    """Create the result tabs and return them along with a content placeholder for each, keyed like the plan"""
+    # Use tabs for better organization
+    tabs = st.tabs([label for label, _, _ in RESULT_TABS])
+
+    placeholders = {}
+    for tab, (_, header, key) in zip(tabs, RESULT_TABS):
+        with tab:
+            st.header(header)
+            placeholders[key] = st.empty()
+
+    return dict(zip(placeholders, tabs)), placeholders
+
+def show_budget_warning(tab):
+    with tab:
+        st.warning("⚠️ Budget calculation hit rate limits. Please try again in a few minutes.")
+        st.info("This is normal for free API tiers. The core travel planning is complete!")
+
+async def plan_trip(inputs, client, use_cache=True):
+    """Run the generation stages, streaming each one into its tab, and return the plan"""
+    # Blocking Groq reads (asyncio.to_thread) get one worker per parallel stage; asyncio.run
+    # shuts the pool down with the loop
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS, thread_name_prefix="groq")
+    )
+
+    # Generate city recommendations
+    st.subheader("🗺️ Your AI-Generated Travel Plan")
+
+    progress_bar = st.progress(0)
+
+    tabs, placeholders = create_result_tabs()
+
+    # Step 1: City Selection
+    with st.status("🌆 Selecting perfect cities for you..."):
+        city_recommendations = await generate_city_recommendations(inputs, client, placeholders["cities"], use_cache)
+        progress_bar.progress(25)
+
+    # Extract first city for detailed planning (simple extraction)
+    match = _CITY_RE.search(city_recommendations)
+    selected_city = match.group(1).strip() if match else "Paris"  # Default fallback
+
+    # Steps 2-4: Research, Itinerary and Budget only depend on the city, so run them together
+    with st.status(f"🗺️ Researching {selected_city} and planning your {inputs.duration}-day trip..."):
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        research, itinerary, budget_plan = await gather_limited(
+            semaphore,
+            generate_destination_research(selected_city, inputs, client, placeholders["research"], use_cache),
+            generate_itinerary(selected_city, inputs, client, placeholders["itinerary"], use_cache),
+            generate_budget_plan(selected_city, inputs, client, placeholders["budget"], use_cache),
+        )
+        progress_bar.progress(100)
+
+    if isinstance(research, Exception):
+        raise research
+    if isinstance(itinerary, Exception):
+        raise itinerary
+    if isinstance(budget_plan, Exception):
+        show_budget_warning(tabs["budget"])
+        budget_plan = None
+
+    return {
+        "cities": city_recommendations,
+        "research": research,
+        "itinerary": itinerary,
+        "budget": budget_plan,
+    }
+
+def render_plan(plan):
+    """Render a previously generated plan without calling the LLM again"""
+    st.subheader("🗺️ Your AI-Generated Travel Plan")
+
+    tabs, placeholders = create_result_tabs()
+    for key, placeholder in placeholders.items():
+        if plan[key] is not None:
+            render_markdown(placeholder, plan[key])
+    if plan["budget"] is None:
+        show_budget_warning(tabs["budget"])
 
 def main():
     st.set_page_config(page_title="AI Travel Planner 🧳", page_icon="🌍", layout="wide")
     st.title("🌍 AI Travel Planning Assistant")
 
-    st.markdown("""
-    Welcome to your AI-powered travel planner! Tell us your preferences, and our AI
-    will craft a personalized itinerary and budget for your next adventure.
-    """)
+    st.markdown(WELCOME_MD)
 
     with st.sidebar:
         st.header("⚙️ Trip Preferences")
-        travel_type = st.selectbox("✈️ Travel Type", ["Leisure", "Business", "Adventure", "Cultural", "Relaxation", "Family Trip"], index=0)
-        interests = st.multiselect("🎯 Interests", ["History", "Food", "Nature", "Art", "Shopping", "Nightlife", "Beaches", "Mountains", "Museums", "Sports", "Music", "Wildlife"])
-        season = st.selectbox("🌤️ Season", ["Summer", "Winter", "Spring", "Fall", "Any"], index=4)
+        travel_type = st.selectbox("✈️ Travel Type", TRAVEL_TYPES, index=0)
+        interests = st.multiselect("🎯 Interests", INTERESTS)
+        season = st.selectbox("🌤️ Season", SEASONS, index=4)
         duration = st.slider("🕐 Trip Duration (days)", 1, 14, 7)
-        budget = st.selectbox("💰 Budget Range (per day, excluding flights)",
-                              ["Budget (Rs500-Rs1500)", "Mid-range (Rs1500-Rs4000)", "Luxury (Rs4000+)"], index=1)
+        budget = st.selectbox("💰 Budget Range (per day, excluding flights)", BUDGETS, index=1)
+
+    inputs = TripInputs(travel_type, tuple(interests), season, duration, budget)
+    # Streamlit re-executes this script (redefining TripInputs) on every rerun, and dataclass
+    # equality requires the same class object, so saved plans are matched on the field values
+    inputs_key = astuple(inputs)
 
-    if st.button("🚀 Generate Travel Plan", key="generate_button", help="Click to start the AI planning process"):
+    # Plans live in session state so later reruns (any widget change) don't repeat the LLM calls
+    saved_plan = st.session_state.get("plan")
+
+    if st.session_state.pop("generating", False):
+        # The previous run was interrupted before the plan finished
+        st.info("⏹️ Generation stopped. Adjust your preferences and generate again when ready.")
+
+    generate = st.button("🚀 Generate Travel Plan", key="generate_button", help="Click to start the AI planning process")
+    regenerate = saved_plan is not None and st.button("🔄 Regenerate", key="regenerate_button",
+                                                      help="Ask the AI for a fresh plan instead of reusing saved results")
+
+    if generate and saved_plan is not None and saved_plan["inputs_key"] == inputs_key and saved_plan.get("complete"):
+        # Nothing changed since the saved plan was generated, and every stage succeeded;
+        # failed stages are retried (successful ones come back from the response cache)
+        generate = False
+
+    if generate or regenerate:
         if not interests:
             st.warning("⚠️ Please select at least one interest to help us plan your trip better.")
             return
@@ -154,84 +390,24 @@ def main():
             st.error("❌ Groq API key not found. Please check your configuration.")
             return
 
-        inputs = {
-            "travel_type": travel_type,
-            "interests": ', '.join(interests),
-            "season": season,
-            "duration": duration,
-            "budget": budget
-        }
+        client = get_groq_client()
 
-        # Initialize Groq client
-        client = Groq(api_key=groq_api_key)
+        # Clicking any widget reruns the script, which interrupts the plan in progress
+        st.button("⏹️ Stop Generation", key="stop_button", help="Cancel the plan that is being generated")
+        st.session_state["generating"] = True
 
         with st.spinner("🧠 AI is working on your perfect trip... This may take a few minutes. Please be patient."):
             try:
-                # Generate city recommendations
-                st.subheader("🗺️ Your AI-Generated Travel Plan")
-                
-                progress_bar = st.progress(0)
-                
-                # Step 1: City Selection
-                with st.status("🌆 Selecting perfect cities for you..."):
-                    city_recommendations = generate_city_recommendations(inputs, client)
-                    progress_bar.progress(25)
-                
-                # Extract first city for detailed planning (simple extraction)
-                lines = city_recommendations.split('\n')
-                selected_city = "Paris"  # Default fallback
-                for line in lines:
-                    if any(char.isdigit() for char in line) and any(char.isalpha() for char in line):
-                        # Try to extract city name from numbered list
-                        parts = line.split('.')
-                        if len(parts) > 1:
-                            city_part = parts[1].split(',')[0].split('-')[0].strip()
-                            if len(city_part) > 2:
-                                selected_city = city_part
-                                break
-
-                # Use tabs for better organization
-                tab1, tab2, tab3, tab4 = st.tabs(["Cities", "Research", "Itinerary", "Budget"])
-
-                with tab1:
-                    st.header("🌆 Recommended Cities")
-                    st.markdown(f'<div style="font-size: 16px;">{clean_surrogates(city_recommendations)}</div>', unsafe_allow_html=True)
-
-                # Step 2: Research
-                with st.status(f"🗺️ Researching {selected_city}..."):
-                    research = generate_destination_research(selected_city, inputs, client)
-                    progress_bar.progress(50)
-
-                with tab2:
-                    st.header("🗺 Destination Insights")
-                    st.markdown(f'<div style="font-size: 16px;">{clean_surrogates(research)}</div>', unsafe_allow_html=True)
-
-                # Step 3: Itinerary
-                with st.status(f"📅 Creating {duration}-day itinerary..."):
-                    itinerary = generate_itinerary(selected_city, inputs, client)
-                    progress_bar.progress(75)
-
-                with tab3:
-                    st.header("📅 Detailed Itinerary")
-                    st.markdown(f'<div style="font-size: 16px;">{clean_surrogates(itinerary)}</div>', unsafe_allow_html=True)
-
-                # Step 4: Budget
-                with st.status("💸 Calculating budget breakdown..."):
-                    try:
-                        budget_plan = generate_budget_plan(selected_city, inputs, client)
-                        progress_bar.progress(100)
-                        
-                        with tab4:
-                            st.header("💸 Budget Breakdown")
-                            st.markdown(f'<div style="font-size: 16px;">{clean_surrogates(budget_plan)}</div>', unsafe_allow_html=True)
-                    except Exception as e:
-                        with tab4:
-                            st.header("💸 Budget Breakdown")
-                            st.warning("⚠️ Budget calculation hit rate limits. Please try again in a few minutes.")
-                            st.info("This is normal for free API tiers. The core travel planning is complete!")
-
-                # Success message at the very end
-                st.success("✅ Trip planning completed! Enjoy your journey! 🎉")
+                plan = asyncio.run(plan_trip(inputs, client, use_cache=not regenerate))
+                # Checked now: a rerun redefines StageError, so saved results can't be re-tested
+                complete = not any(isinstance(result, StageError) for result in plan.values())
+                st.session_state["plan"] = {"inputs_key": inputs_key, "results": plan, "complete": complete}
+
+                if complete:
+                    # Success message at the very end
+                    st.success("✅ Trip planning completed! Enjoy your journey! 🎉")
+                else:
+                    st.warning("⚠️ Some parts of the plan could not be generated. Wait 1-2 minutes and click Generate to retry them.")
 
             except Exception as e:
                 st.error("❌ An error occurred while generating the travel plan:")
@@ -244,5 +420,12 @@ def main():
                 4. Check if your Groq API key is valid
                 """)
 
+        st.session_state["generating"] = False
+
+    elif saved_plan is not None:
+        if saved_plan["inputs_key"] != inputs_key:
+            st.caption("ℹ️ Your preferences changed since this plan was generated. Click Generate to update it.")
+        render_plan(saved_plan["results"])
+
 if __name__ == "__main__":
     main()
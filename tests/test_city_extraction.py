@@ -0,0 +1,61 @@
+import pytest
+
+pytest.importorskip("crewai")
+pytest.importorskip("litellm")
+
+from trip_agents import TripCrew
+
+
+@pytest.fixture
+def crew():
+    # City extraction only reads its arguments, so skip the LLM setup in __init__
+    return TripCrew.__new__(TripCrew)
+
+
+NESTED_LIST = """1. Paris, France - The city of light.
+   - Why it matches: museums and cafes
+   - Season: mild spring weather
+2. Rome, Italy - Ancient history everywhere.
+   - Why it matches: ruins and food
+3. Kyoto, Japan - Temples and gardens.
+"""
+
+HEADING_LIST = """Here are the 3 best cities for your Cultural trip:
+
+### 1. Lisbon, Portugal
+Historic trams and fado.
+
+### 2. Porto, Portugal
+Port wine cellars.
+"""
+
+LABEL_ECHO = """1. City name and country: Barcelona, Spain
+2. Why it matches: Beaches and Gaudi architecture
+3. Why it's perfect for the season: Warm summer evenings
+4. Brief highlight: La Sagrada Familia
+"""
+
+
+@pytest.mark.parametrize("output, k, expected", [
+    (NESTED_LIST, 3, ["Paris", "Rome", "Kyoto"]),
+    ("1. Paris, France - ...\n**2. Rome, Italy**\n", 3, ["Paris", "Rome"]),
+    (HEADING_LIST, 3, ["Lisbon", "Porto"]),
+    (LABEL_ECHO, 3, ["Barcelona"]),
+    ("- Paris, France: art\n  - Why it matches: x\n* Rome - history\n", 3, ["Paris", "Rome"]),
+])
+def test_extract_cities(crew, output, k, expected):
+    assert crew.extract_cities(output, k) == expected
+
+
+@pytest.mark.parametrize("output, expected", [
+    (NESTED_LIST, "Paris"),
+    (HEADING_LIST, "Lisbon"),
+    (LABEL_ECHO, "Barcelona"),
+])
+def test_extract_first_city(crew, output, expected):
+    assert crew.extract_first_city(output) == expected
+
+
+def test_first_numbered_city_waits_for_a_complete_line(crew):
+    assert crew._first_numbered_city("### 1. Lis") is None
+    assert crew._first_numbered_city(HEADING_LIST[:80]) == "Lisbon"
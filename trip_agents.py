@@ -1,26 +1,50 @@
+import asyncio
+import functools
+import hashlib
+import importlib.util
+import json
 import os
+import random
 import re
+import sqlite3
+import threading
+import time
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
+import litellm
 from crewai import Agent, Task, Crew
 from crewai.llm import LLM
 from dotenv import load_dotenv
+from litellm.exceptions import (
+    APIConnectionError,
+    InternalServerError,
+    RateLimitError,
+    ServiceUnavailableError,
+    Timeout,
+)
+
+try:
+    import orjson # Optional: faster canonical JSON for cache keys
+except ImportError:
+    orjson = None
 
 # Load environment variables using absolute path
 # Ensure .env.local is in the same directory as this script, or adjust the path
 env_path = os.path.join(os.getcwd(), ".env.local")
 load_dotenv(dotenv_path=env_path)
 
-# --- START OF ADDED DEBUG PRINTS (from Step 2) ---
-print(f"\n--- Environment Variable Check ---")
-hf_api_key_check = os.getenv('HUGGINGFACE_API_KEY')
-print(f"DEBUG: HUGGINGFACE_API_KEY = {'*' * (len(hf_api_key_check) - 5) + hf_api_key_check[-5:] if hf_api_key_check else 'None (HF key not found)'}")
-print(f"DEBUG: LITELLM_MODEL = {os.getenv('LITELLM_MODEL')}")
-print(f"DEBUG: LITELLM_PROVIDER = {os.getenv('LITELLM_PROVIDER')}")
-openai_api_key_check = os.getenv('OPENAI_API_KEY')
-print(f"DEBUG: OPENAI_API_KEY = {'*' * (len(openai_api_key_check) - 5) + openai_api_key_check[-5:] if openai_api_key_check else 'None (OpenAI key not found)'}")
-groq_api_key_check = os.getenv('GROQ_API_KEY')
-print(f"DEBUG: GROQ_API_KEY = {'*' * (len(groq_api_key_check) - 5) + groq_api_key_check[-5:] if groq_api_key_check else 'None (Groq key not found)'}")
-print(f"----------------------------------\n")
-# --- END OF ADDED DEBUG PRINTS ---
+def _masked(value, missing):
+    return '*' * (len(value) - 5) + value[-5:] if value else missing
+
+# Environment check, only when TRIPSMART_DEBUG=1 so plain imports stay quiet
+if os.getenv("TRIPSMART_DEBUG") == "1":
+    print(f"\n--- Environment Variable Check ---")
+    print(f"DEBUG: HUGGINGFACE_API_KEY = {_masked(os.getenv('HUGGINGFACE_API_KEY'), 'None (HF key not found)')}")
+    print(f"DEBUG: LITELLM_MODEL = {os.getenv('LITELLM_MODEL')}")
+    print(f"DEBUG: LITELLM_PROVIDER = {os.getenv('LITELLM_PROVIDER')}")
+    print(f"DEBUG: OPENAI_API_KEY = {_masked(os.getenv('OPENAI_API_KEY'), 'None (OpenAI key not found)')}")
+    print(f"DEBUG: GROQ_API_KEY = {_masked(os.getenv('GROQ_API_KEY'), 'None (Groq key not found)')}")
+    print(f"----------------------------------\n")
 
 # Set up Hugging Face API key
 hf_api_key = os.getenv("HUGGINGFACE_API_KEY")
@@ -28,136 +52,431 @@ if not hf_api_key:
     print("WARNING: HUGGINGFACE_API_KEY not found in environment variables or is empty.")
     print("If you intend to use Hugging Face models, please set it in .env.local.")
 
+_SURROGATE_RE = re.compile(r'[\ud800-\udfff]')
+
 # Clean invalid surrogate characters (for Windows terminal issues)
 def clean_surrogates(text):
     if isinstance(text, str):
-        return re.sub(r'[\ud800-\udfff]', '', text)
+        # Pure-ASCII text cannot contain surrogates; skip the scan and the copy
+        if text.isascii():
+            return text
+        return _SURROGATE_RE.sub('', text)
     return text
 
-class TripAgents:
-    def __init__(self):
-        # Initialize the LLM once for all agents
-        self.llm = self._initialize_llm()
-        if not self.llm:
-            # This check will now be hit if _initialize_llm raises an exception,
-            # but it also handles the case if it somehow still returns None.
-            raise RuntimeError("Failed to initialize any LLM. Please check your API keys and model configurations.")
-
-    def _initialize_llm(self):
-        """Initialize LLM with proper configuration, trying multiple providers/models."""
-
-        # Set up environment variables for LiteLLM
-        os.environ["LITELLM_LOG"] = os.getenv("LITELLM_LOG", "DEBUG")
-
-        # Get model configuration from environment
-        model_name = os.getenv("LITELLM_MODEL", "microsoft/DialoGPT-medium")
-        provider = os.getenv("LITELLM_PROVIDER", "huggingface")
-
-        # --- Attempt 1: Groq (Primary) ---
-        groq_key = os.getenv("GROQ_API_KEY")
-        if groq_key:
-            try:
-                print("🤖 Initializing LLM with primary Groq model...")
-                # Set environment variables for Groq
-                os.environ['GROQ_API_KEY'] = groq_key
-                llm = LLM(
-                    model="llama3-8b-8192",
-                    temperature=0.7,
-                    max_tokens=1000,
-                    custom_llm_provider="groq"
-                )
-                print("✅ Successfully initialized Groq model.")
-                return llm
-            except Exception as e3:
-                print(f"❌ Groq failed: {e3}")
-                print("Trying alternative Groq models...")
-                
-                # Try alternative Groq models
-                groq_models = [
-                    "mixtral-8x7b-32768",
-                    "llama2-70b-4096",
-                    "gemma-7b-it"
-                ]
-                for groq_model in groq_models:
-                    try:
-                        print(f"🔄 Trying alternative Groq model: {groq_model}")
-                        llm = LLM(
-                            model=groq_model,
-                            temperature=0.7,
-                            max_tokens=1000,
-                            custom_llm_provider="groq"
-                        )
-                        print(f"✅ Successfully initialized alternative Groq model: {groq_model}")
-                        return llm
-                    except Exception as e4:
-                        print(f"❌ Failed to initialize {groq_model}: {e4}")
-                        continue
+# Patterns used to pull city names out of the selector output, most specific first
+# Numbered list lines, allowing heading/bold markers before the number ("### 1. Lisbon",
+# "**2. Rome**, Italy"); group 1 is the indent, group 2 the entry text
+_CITY_NUMBERED_RE = re.compile(r"^([ \t]*)[*# \t]*\d+\.[ \t*]*(.*)$", re.M)
+
+# City name at the start of a numbered entry's text
+_CITY_NAME_RE = re.compile(r"([A-Z][a-zA-Z\s]+?)[ \t*]*(?:,|[ \t]*[-:(]|$)")
+
+# Unindented bullet entries ("- **Kyoto** - ..."), for outputs without a numbered list
+_CITY_BULLET_RE = re.compile(
+    r"^[-*•](?=\s)[ \t*]*([A-Z][a-zA-Z\s]+?)[ \t*]*(?:,|[ \t]*[-:]|\n)", re.M
+)
+
+# Looser fallbacks for outputs that are not a list
+_CITY_FALLBACK_PATTERNS = tuple(re.compile(pattern) for pattern in (
+    r"(\b[A-Z][a-zA-Z\s]+?)(?:\s*[-,:])",  # City names followed by punctuation
+    r"([A-Z][a-zA-Z\s]{3,25})"  # Any capitalized words (cities), minimum 3 letters
+))
+
+# Common non-city words; candidates starting with any of them are rejected
+_EXCLUDED_PREFIXES = (
+    'the', 'and', 'for', 'with', 'city', 'travel', 'trip', 'based', 'type', 'perfect', 'best',
+    'experience', 'plan', 'planning', 'expert', 'reasons', 'selection'
+)
+
+# Failures worth retrying: rate limits (429), provider 5xx and network hiccups
+TRANSIENT_LLM_ERRORS = (
+    RateLimitError,
+    APIConnectionError,
+    Timeout,
+    ServiceUnavailableError,
+    InternalServerError,
+    TimeoutError,
+    ConnectionError,
+)
+
+def call_with_retry(fn, max_retries=3):
+    """Call fn(), retrying transient LLM errors with exponential backoff plus jitter"""
+    for attempt in range(max_retries):
+        try:
+            return fn()
+        except TRANSIENT_LLM_ERRORS as e:
+            if attempt == max_retries - 1:
+                raise
+            delay = (2 ** attempt) + random.uniform(0, 1)
+            print(f"⏳ Transient LLM error ({e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+# Opt-in on-disk cache of LLM outputs, enabled with TRIPSMART_CACHE=1
+CACHE_PATH = os.getenv("TRIPSMART_CACHE_PATH", "llm_cache.db")
+CACHE_TTL = int(os.getenv("TRIPSMART_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+CACHE_MAX_ENTRIES = int(os.getenv("TRIPSMART_CACHE_MAX_ENTRIES", "1000"))
+
+class ResponseCache:
+    """SQLite-backed cache of crew outputs, keyed by a SHA-256 of everything that affects them."""
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, response BLOB, ts INTEGER, last_used INTEGER, model TEXT)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(**payload):
+        """Hash output-affecting parameters only (never API keys or verbosity flags)"""
+        # Both encoders emit the same compact UTF-8 JSON, so keys match with or without orjson
+        if orjson is not None:
+            canonical = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS, default=str)
         else:
-            print("Skipping Groq: GROQ_API_KEY not provided.")
-
-        # --- Attempt 2: Hugging Face (Fallback) ---
-        if hf_api_key:
-            # IMPORTANT CHANGE: Pass only the model_name here.
-            # LiteLLM will implicitly use the provider specified by LITELLM_PROVIDER env var.
-            litellm_model_for_hf = model_name
-            print(f"🔄 Trying Hugging Face as fallback (via {provider} provider): {litellm_model_for_hf}")
-            try:
-                llm = LLM(
-                    model=litellm_model_for_hf, # Pass just the model name
-                    api_key=hf_api_key,          # Explicitly pass the HF API key
-                    temperature=0.7,
-                    max_tokens=1000
-                )
-                print("✅ Successfully initialized Hugging Face model.")
-                return llm
-            except Exception as e:
-                print(f"❌ Failed to initialize Hugging Face model {litellm_model_for_hf}: {e}")
-                print("Trying alternative Hugging Face models...")
-
-            # Attempt 2.1: Alternative Hugging Face models
-            alternative_hf_models = [
-                "google/flan-t5-base",
-                "microsoft/DialoGPT-small",
-                "HuggingFaceH4/zephyr-7b-beta"
+            canonical = json.dumps(
+                payload, sort_keys=True, default=str, separators=(",", ":"), ensure_ascii=False
+            ).encode("utf-8")
+        return hashlib.sha256(canonical).hexdigest()
+
+    def get(self, key):
+        now = int(time.time())
+        with self._lock:
+            row = self._conn.execute("SELECT response, ts FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            response, ts = row
+            if now - ts > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(response)
+
+    def set(self, key, value, model=None):
+        now = int(time.time())
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, ts, last_used, model) VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(value).encode("utf-8"), now, now, model)
+            )
+            # Trim least recently used entries beyond max_entries
+            self._conn.execute(
+                "DELETE FROM responses WHERE key NOT IN "
+                "(SELECT key FROM responses ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+@functools.lru_cache(maxsize=1)
+def get_response_cache():
+    """Process-wide ResponseCache, or None unless TRIPSMART_CACHE=1"""
+    if os.getenv("TRIPSMART_CACHE") != "1":
+        return None
+    return ResponseCache()
+
+# Opt-in near-duplicate cache of whole trip plans, enabled with TRIPSMART_SEMANTIC_CACHE=1
+SEMANTIC_CACHE_MODEL = os.getenv("TRIPSMART_SEMANTIC_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("TRIPSMART_SEMANTIC_THRESHOLD", "0.90"))  # cosine similarity
+
+class SemanticCache:
+    """Trip plans looked up by sentence embedding of the traveler's interests.
+
+    Entries only match within the same scope, a key over everything that must match
+    exactly: model settings and the fixed choices (travel type, season, duration,
+    budget). Each scope has its own FAISS index, so entries from other scopes never
+    take up search results. Embeddings are stored next to the plans in SQLite and the
+    indexes are rebuilt from them when the cache opens.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, threshold=SEMANTIC_CACHE_THRESHOLD):
+        # Heavy optional dependencies, only imported when the semantic cache is enabled
+        import faiss
+        import numpy as np
+        from sentence_transformers import SentenceTransformer
+
+        self._faiss = faiss
+        self._np = np
+        self.ttl = ttl
+        self.threshold = threshold
+        self._model = SentenceTransformer(SEMANTIC_CACHE_MODEL)
+        self._dimension = self._model.get_sentence_embedding_dimension()
+        self._indexes = {}  # scope -> FAISS index of that scope's row ids
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS semantic_responses "
+            "(id INTEGER PRIMARY KEY, scope TEXT, embedding BLOB, response BLOB, ts INTEGER)"
+        )
+        self._conn.execute("DELETE FROM semantic_responses WHERE ts < ?", (int(time.time()) - ttl,))
+        self._conn.commit()
+
+        for row_id, scope, embedding in self._conn.execute("SELECT id, scope, embedding FROM semantic_responses"):
+            self._add(scope, row_id, np.frombuffer(embedding, dtype="float32").reshape(1, -1))
+
+    def _embed(self, text):
+        # Normalized vectors make inner product equal to cosine similarity
+        return self._model.encode([text], normalize_embeddings=True).astype("float32")
+
+    def _add(self, scope, row_id, vector):
+        if scope not in self._indexes:
+            self._indexes[scope] = self._faiss.IndexIDMap(self._faiss.IndexFlatIP(self._dimension))
+        self._indexes[scope].add_with_ids(vector, self._np.array([row_id], dtype="int64"))
+
+    def _purge_expired(self):
+        """Drop expired rows from SQLite and their ids from the indexes"""
+        expired = self._conn.execute(
+            "SELECT id, scope FROM semantic_responses WHERE ts < ?", (int(time.time()) - self.ttl,)
+        ).fetchall()
+        if not expired:
+            return
+        self._conn.execute("DELETE FROM semantic_responses WHERE id IN (%s)" % ",".join("?" * len(expired)),
+                           [row_id for row_id, _ in expired])
+        self._conn.commit()
+        for row_id, scope in expired:
+            index = self._indexes.get(scope)
+            if index is not None:
+                index.remove_ids(self._np.array([row_id], dtype="int64"))
+
+    def get(self, scope, text):
+        vector = self._embed(text)
+        with self._lock:
+            self._purge_expired()
+            index = self._indexes.get(scope)
+            if index is None or index.ntotal == 0:
+                return None
+            # Every candidate already shares the scope, so only the closest one matters
+            scores, ids = index.search(vector, 1)
+            if scores[0][0] < self.threshold:
+                return None
+            row = self._conn.execute(
+                "SELECT response FROM semantic_responses WHERE id = ?", (int(ids[0][0]),)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, scope, text, value):
+        vector = self._embed(text)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO semantic_responses (scope, embedding, response, ts) VALUES (?, ?, ?, ?)",
+                (scope, vector.tobytes(), json.dumps(value).encode("utf-8"), int(time.time()))
+            )
+            self._conn.commit()
+            self._add(scope, cursor.lastrowid, vector)
+
+@functools.lru_cache(maxsize=1)
+def get_semantic_cache():
+    """Process-wide SemanticCache, or None unless TRIPSMART_SEMANTIC_CACHE=1"""
+    if os.getenv("TRIPSMART_SEMANTIC_CACHE") != "1":
+        return None
+    try:
+        return SemanticCache()
+    except ImportError as e:
+        print(f"WARNING: Semantic cache disabled, missing optional dependency: {e}")
+        return None
+
+def completion_params(llm):
+    """litellm.completion keyword arguments matching a CrewAI LLM's configuration"""
+    params = {
+        "model": llm.model,
+        "temperature": llm.temperature,
+        "max_tokens": llm.max_tokens,
+    }
+    if getattr(llm, "api_key", None):
+        params["api_key"] = llm.api_key
+    # Extra constructor kwargs such as custom_llm_provider and num_retries
+    params.update(getattr(llm, "additional_params", None) or {})
+    return params
+
+def _share_http_connections():
+    """Give LiteLLM one keep-alive httpx.Client so later calls reuse warm TLS connections"""
+    if litellm.client_session is not None:
+        return
+    import httpx
+    litellm.client_session = httpx.Client(
+        http2=importlib.util.find_spec("h2") is not None, # HTTP/2 needs the optional h2 package
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30),
+    )
+
+@functools.lru_cache(maxsize=1)
+def get_llm():
+    """Initialize LLM with proper configuration, trying multiple providers/models.
+
+    Cached for the life of the process, so only the first TripAgents pays for the
+    provider fallback cascade; failures are not cached and are retried next call.
+    """
+
+    # Set up environment variables for LiteLLM
+    os.environ.setdefault("LITELLM_LOG", "DEBUG")
+    _share_http_connections()
+
+    # Get model configuration from environment
+    model_name = os.getenv("LITELLM_MODEL", "microsoft/DialoGPT-medium")
+    provider = os.getenv("LITELLM_PROVIDER", "huggingface")
+
+    # --- Attempt 1: Groq (Primary) ---
+    groq_key = os.getenv("GROQ_API_KEY")
+    if groq_key:
+        try:
+            print("🤖 Initializing LLM with primary Groq model...")
+            llm = LLM(
+                model="llama3-8b-8192",
+                temperature=0.7,
+                max_tokens=1000,
+                custom_llm_provider="groq",
+                num_retries=0  # call_with_retry owns retries; skip LiteLLM's own long 429 backoff
+            )
+            print("✅ Successfully initialized Groq model.")
+            return llm
+        except Exception as e3:
+            print(f"❌ Groq failed: {e3}")
+            print("Trying alternative Groq models...")
+            
+            # Try alternative Groq models
+            groq_models = [
+                "mixtral-8x7b-32768",
+                "llama2-70b-4096",
+                "gemma-7b-it"
             ]
-            for alt_model in alternative_hf_models:
+            for groq_model in groq_models:
                 try:
-                    print(f"🔄 Trying alternative Hugging Face model: {alt_model}")
+                    print(f"🔄 Trying alternative Groq model: {groq_model}")
                     llm = LLM(
-                        model=alt_model,          # Pass just the model name
-                        api_key=hf_api_key,       # Always pass the HF key
+                        model=groq_model,
                         temperature=0.7,
-                        max_tokens=800
+                        max_tokens=1000,
+                        custom_llm_provider="groq",
+                        num_retries=0
                     )
-                    print(f"✅ Successfully initialized alternative Hugging Face model: {alt_model}")
+                    print(f"✅ Successfully initialized alternative Groq model: {groq_model}")
                     return llm
-                except Exception as e2:
-                    print(f"❌ Failed to initialize {alt_model}: {e2}")
+                except Exception as e4:
+                    print(f"❌ Failed to initialize {groq_model}: {e4}")
                     continue
-        else:
-            print("Skipping Hugging Face models: HUGGINGFACE_API_KEY not provided.")
-
-        # --- Attempt 3: OpenAI (Fallback) ---
-        openai_key = os.getenv("OPENAI_API_KEY")
-        if openai_key:
+    else:
+        print("Skipping Groq: GROQ_API_KEY not provided.")
+
+    # --- Attempt 2: Hugging Face (Fallback) ---
+    if hf_api_key:
+        # IMPORTANT CHANGE: Pass only the model_name here.
+        # LiteLLM will implicitly use the provider specified by LITELLM_PROVIDER env var.
+        litellm_model_for_hf = model_name
+        print(f"🔄 Trying Hugging Face as fallback (via {provider} provider): {litellm_model_for_hf}")
+        try:
+            llm = LLM(
+                model=litellm_model_for_hf, # Pass just the model name
+                api_key=hf_api_key,          # Explicitly pass the HF API key
+                temperature=0.7,
+                max_tokens=1000
+            )
+            print("✅ Successfully initialized Hugging Face model.")
+            return llm
+        except Exception as e:
+            print(f"❌ Failed to initialize Hugging Face model {litellm_model_for_hf}: {e}")
+            print("Trying alternative Hugging Face models...")
+
+        # Attempt 2.1: Alternative Hugging Face models
+        alternative_hf_models = [
+            "google/flan-t5-base",
+            "microsoft/DialoGPT-small",
+            "HuggingFaceH4/zephyr-7b-beta"
+        ]
+        for alt_model in alternative_hf_models:
             try:
-                print("🔄 Trying OpenAI as fallback...")
+                print(f"🔄 Trying alternative Hugging Face model: {alt_model}")
                 llm = LLM(
-                    model="gpt-3.5-turbo", # Example OpenAI model (no explicit prefix needed, LiteLLM defaults to OpenAI)
-                    api_key=openai_key,
+                    model=alt_model,          # Pass just the model name
+                    api_key=hf_api_key,       # Always pass the HF key
                     temperature=0.7,
-                    max_tokens=1000
+                    max_tokens=800
                 )
-                print("✅ Successfully initialized OpenAI model.")
+                print(f"✅ Successfully initialized alternative Hugging Face model: {alt_model}")
                 return llm
-            except Exception as e4:
-                print(f"❌ OpenAI fallback failed: {e4}")
-        else:
-            print("Skipping OpenAI fallback: OPENAI_API_KEY not provided.")
+            except Exception as e2:
+                print(f"❌ Failed to initialize {alt_model}: {e2}")
+                continue
+    else:
+        print("Skipping Hugging Face models: HUGGINGFACE_API_KEY not provided.")
+
+    # --- Attempt 3: OpenAI (Fallback) ---
+    openai_key = os.getenv("OPENAI_API_KEY")
+    if openai_key:
+        try:
+            print("🔄 Trying OpenAI as fallback...")
+            llm = LLM(
+                model="gpt-3.5-turbo", # Example OpenAI model (no explicit prefix needed, LiteLLM defaults to OpenAI)
+                api_key=openai_key,
+                temperature=0.7,
+                max_tokens=1000
+            )
+            print("✅ Successfully initialized OpenAI model.")
+            return llm
+        except Exception as e4:
+            print(f"❌ OpenAI fallback failed: {e4}")
+    else:
+        print("Skipping OpenAI fallback: OPENAI_API_KEY not provided.")
+
+    print("⚠️ All LLM initialization attempts failed. No LLM could be loaded.")
+    # IMPORTANT CHANGE: Raise an error here if no LLM could be initialized
+    raise RuntimeError("No valid LLM could be initialized. Please check your API keys and model configurations in .env.local.")
+
+# CrewAI's step-by-step console output, off unless TRIPSMART_VERBOSE=1
+VERBOSE = os.getenv("TRIPSMART_VERBOSE") == "1"
+
+# Agent personas. Agents themselves are built fresh per call (see TripAgents), only
+# their configuration is shared.
+_CITY_SELECTOR_CONFIG = {
+    'role': 'City Selection Expert',
+    'goal': 'Identify the 3 best cities to visit based on user preferences including travel type, interests, and season',
+    'backstory': """You are an expert travel geographer with extensive knowledge of global destinations.
+You specialize in matching travelers with perfect cities based on their preferences, interests, and travel seasons.
+You always provide exactly 3 city recommendations with clear reasoning, covering various aspects like culture, adventure, and relaxation.""",
+}
+
+_LOCAL_EXPERT_CONFIG = {
+    'role': 'Local Destination Expert',
+    'goal': 'Provide comprehensive insights about the selected city including attractions, culture, and practical tips',
+    'backstory': """You are a knowledgeable local guide with insider knowledge about cities worldwide.
+You provide detailed information about attractions, local customs, cuisine, and practical travel tips
+that help visitors have an authentic and enjoyable experience.""",
+}
+
+_TRAVEL_PLANNER_CONFIG = {
+    'role': 'Professional Travel Planner',
+    'goal': 'Create detailed, practical day-by-day itineraries that maximize the travel experience',
+    'backstory': """You are an experienced professional travel planner who creates efficient,
+well-organized itineraries. You consider travel time, opening hours, proximity of attractions,
+and optimal scheduling to create the best possible travel experience.""",
+}
+
+_BUDGET_MANAGER_CONFIG = {
+    'role': 'Travel Budget Specialist',
+    'goal': 'Create realistic budget plans that balance cost-effectiveness with quality experiences',
+    'backstory': """You are a financial planning expert specializing in travel budgets.
+You help travelers get the most value for their money while ensuring they don't overspend.
+You consider all aspects of travel costs and provide practical budget breakdowns.""",
+}
+
+class TripAgents:
+    """Factory for the trip planning agents.
+
+    The LLM is stateless (a model name plus an HTTP-pooled client) and can be shared
+    freely, so it may be passed in and reused across instances. Agents are not: they
+    keep per-run state and are not safe to share between concurrent runs, so each
+    *_agent() call returns a fresh Agent.
+    """
 
-        print("⚠️ All LLM initialization attempts failed. No LLM could be loaded.")
-        # IMPORTANT CHANGE: Raise an error here if no LLM could be initialized
-        raise RuntimeError("No valid LLM could be initialized. Please check your API keys and model configurations in .env.local.")
+    def __init__(self, llm=None):
+        # Reuse the process-wide LLM for all agents, unless a specific one is provided
+        self.llm = llm or get_llm()
+        if not self.llm:
+            # This check will now be hit if get_llm raises an exception,
+            # but it also handles the case if it somehow still returns None.
+            raise RuntimeError("Failed to initialize any LLM. Please check your API keys and model configurations.")
 
     def base_agent(self, role, goal, backstory):
         """Create base agent with proper LLM configuration"""
@@ -165,7 +484,7 @@ class TripAgents:
             'role': clean_surrogates(role),
             'goal': clean_surrogates(goal),
             'backstory': clean_surrogates(backstory),
-            'verbose': True,
+            'verbose': VERBOSE,
             'allow_delegation': False,  # Prevent agents from delegating to each other
             'max_iter': 5, # Increased iterations for more robust planning
         }
@@ -174,96 +493,121 @@ class TripAgents:
         if self.llm:
             agent_config['llm'] = self.llm
         else:
-            # This print will technically be redundant if _initialize_llm raises an error,
+            # This print will technically be redundant if get_llm raises an error,
             # but it's good for robustness if the condition is ever met otherwise.
             print("WARNING: LLM not initialized for agents. They might use default or fail.")
 
         return Agent(**agent_config)
 
     def city_selector_agent(self):
-        return self.base_agent(
-            role='City Selection Expert',
-            goal='Identify the 3 best cities to visit based on user preferences including travel type, interests, and season',
-            backstory="""You are an expert travel geographer with extensive knowledge of global destinations.
-            You specialize in matching travelers with perfect cities based on their preferences, interests, and travel seasons.
-            You always provide exactly 3 city recommendations with clear reasoning, covering various aspects like culture, adventure, and relaxation."""
-        )
+        return self.base_agent(**_CITY_SELECTOR_CONFIG)
 
     def local_expert_agent(self):
-        return self.base_agent(
-            role='Local Destination Expert',
-            goal='Provide comprehensive insights about the selected city including attractions, culture, and practical tips',
-            backstory="""You are a knowledgeable local guide with insider knowledge about cities worldwide.
-            You provide detailed information about attractions, local customs, cuisine, and practical travel tips
-            that help visitors have an authentic and enjoyable experience."""
-        )
+        return self.base_agent(**_LOCAL_EXPERT_CONFIG)
 
     def travel_planner_agent(self):
-        return self.base_agent(
-            role='Professional Travel Planner',
-            goal='Create detailed, practical day-by-day itineraries that maximize the travel experience',
-            backstory="""You are an experienced professional travel planner who creates efficient,
-            well-organized itineraries. You consider travel time, opening hours, proximity of attractions,
-            and optimal scheduling to create the best possible travel experience."""
-        )
+        return self.base_agent(**_TRAVEL_PLANNER_CONFIG)
 
     def budget_manager_agent(self):
-        return self.base_agent(
-            role='Travel Budget Specialist',
-            goal='Create realistic budget plans that balance cost-effectiveness with quality experiences',
-            backstory="""You are a financial planning expert specializing in travel budgets.
-            You help travelers get the most value for their money while ensuring they don't overspend.
-            You consider all aspects of travel costs and provide practical budget breakdowns."""
-        )
+        return self.base_agent(**_BUDGET_MANAGER_CONFIG)
+
+# Task description templates, filled with str.format_map. Each *_DEFAULTS mapping supplies
+# the value used when an input is missing.
+_CITY_SELECTION_TEMPLATE = """
+Based on the following user preferences, select the 3 best cities to visit:
+
+Travel Type: {travel_type}
+Interests: {interests}
+Season: {season}
+Budget Range: {budget}
+Duration: {duration} days
+
+For each city, provide:
+1. City name and country
+2. Why it matches their travel type and interests
+3. Why it's perfect for the specified season
+4. Brief highlight of what makes it special
+
+Format your response as a numbered list with city names clearly stated.
+"""
+_CITY_SELECTION_DEFAULTS = dict.fromkeys(('travel_type', 'interests', 'season', 'budget', 'duration'), 'Not specified')
+
+_CITY_RESEARCH_TEMPLATE = """
+Provide comprehensive research about {city} including:
+
+1. TOP 5 ATTRACTIONS: Must-visit places with brief descriptions and estimated time to visit each.
+2. LOCAL CUISINE: Signature dishes and where to find them (e.g., specific types of restaurants or markets).
+3. CULTURAL INSIGHTS: Important customs, etiquette, and cultural norms (e.g., tipping, greetings).
+4. ACCOMMODATION: Best areas to stay for different budgets (e.g., luxury, mid-range, budget) and types of lodging.
+5. TRANSPORTATION: How to get around the city efficiently (public transport, taxis, ride-shares) and airport transfers.
+6. BEST TIME TO VISIT: Optimal months, what to expect regarding weather and crowds, and major events if any.
+7. PRACTICAL TIPS: Essential information for first-time visitors (e.g., currency, safety, language basics, common scams).
+
+Make this practical and actionable for travelers, using bullet points or numbered lists where appropriate for clarity.
+"""
+
+_ITINERARY_TEMPLATE = """
+Create a detailed {duration}-day itinerary for {city} based on:
+- Travel Type: {travel_type}
+- Interests: {interests}
+- Duration: {duration} days
+- Current location: Surat, Gujarat, India (Consider this for travel logistics if applicable, but focus on the destination city itself)
+
+For each day, include:
+1. DAY NUMBER: Clearly state the day (e.g., 'Day 1: Arrival and City Exploration')
+2. Morning activities (9 AM - 12 PM) with specific attractions/locations
+3. Afternoon activities (12 PM - 5 PM) with specific attractions/locations
+4. Evening activities (5 PM - 9 PM) including recommendations for dinner/nightlife
+5. Recommended restaurants for each meal (Breakfast, Lunch, Dinner) with type of cuisine
+6. Estimated transportation methods between locations (e.g., 'walk', 'metro', 'taxi')
+7. Estimated time for each activity
+8. Any booking requirements or tips (e.g., 'Book in advance', 'Wear comfortable shoes')
+
+Make sure activities are geographically logical, account for realistic travel time between locations,
+and maximize the experience given the specified travel type and interests.
+"""
+_ITINERARY_DEFAULTS = {'duration': '3', 'travel_type': 'leisure', 'interests': 'general sightseeing'}
+
+_BUDGET_TEMPLATE = """
+Create a realistic budget plan for a {duration}-day trip to {city} assuming a {budget} budget.
+Consider that the traveler is from Surat, Gujarat, India, which might influence spending habits or expectations.
+
+Break down costs for the following categories:
+1. ACCOMMODATION: Per night costs and total for {duration} nights. Provide options for the given budget.
+2. MEALS: Daily averages for Breakfast, Lunch, Dinner. Provide typical costs for different meal types.
+3. TRANSPORTATION: Local transport (daily passes, single rides), airport transfers (round trip), and potentially inter-city travel if applicable.
+4. ATTRACTIONS: Entry fees for major sights and activities.
+5. SHOPPING & MISCELLANEOUS: Estimated daily allowance for souvenirs, snacks, coffee, and small purchases.
+6. EMERGENCY FUND: A recommended 10-15% buffer of the total estimated cost.
+
+Provide:
+- Daily budget estimates for each category.
+- Total estimated budget for the entire {duration}-day trip.
+- Money-saving tips specific to {city}.
+- Splurge recommendations (e.g., a fancy dinner, unique experience) with estimated costs.
+
+Use currency relevant to the destination city or provide a clear indication (e.g., USD, EUR, local currency).
+"""
+_BUDGET_DEFAULTS = {'budget': 'moderate', 'duration': '3', 'travel_type': 'leisure'}
 
 class TripTasks:
     def city_selection_task(self, agent, inputs):
-        description = f"""
-        Based on the following user preferences, select the 3 best cities to visit:
-
-        Travel Type: {inputs.get('travel_type', 'Not specified')}
-        Interests: {inputs.get('interests', 'Not specified')}
-        Season: {inputs.get('season', 'Not specified')}
-        Budget Range: {inputs.get('budget', 'Not specified')}
-        Duration: {inputs.get('duration', 'Not specified')} days
-
-        For each city, provide:
-        1. City name and country
-        2. Why it matches their travel type and interests
-        3. Why it's perfect for the specified season
-        4. Brief highlight of what makes it special
-
-        Format your response as a numbered list with city names clearly stated.
-        """
-
         return Task(
-            description=clean_surrogates(description),
+            name="city_selection",
+            description=_CITY_SELECTION_TEMPLATE.format_map(ChainMap(inputs, _CITY_SELECTION_DEFAULTS)),
             agent=agent,
-            expected_output=clean_surrogates(
+            expected_output=(
                 "A numbered list of exactly 3 cities with clear city names and 2-3 sentence explanations for each, "
                 "explaining why each city is perfect for the user's preferences. Example: '1. Paris, France - ...'"
             )
         )
 
     def city_research_task(self, agent, city):
-        description = f"""
-        Provide comprehensive research about {city} including:
-
-        1. TOP 5 ATTRACTIONS: Must-visit places with brief descriptions and estimated time to visit each.
-        2. LOCAL CUISINE: Signature dishes and where to find them (e.g., specific types of restaurants or markets).
-        3. CULTURAL INSIGHTS: Important customs, etiquette, and cultural norms (e.g., tipping, greetings).
-        4. ACCOMMODATION: Best areas to stay for different budgets (e.g., luxury, mid-range, budget) and types of lodging.
-        5. TRANSPORTATION: How to get around the city efficiently (public transport, taxis, ride-shares) and airport transfers.
-        6. BEST TIME TO VISIT: Optimal months, what to expect regarding weather and crowds, and major events if any.
-        7. PRACTICAL TIPS: Essential information for first-time visitors (e.g., currency, safety, language basics, common scams).
-
-        Make this practical and actionable for travelers, using bullet points or numbered lists where appropriate for clarity.
-        """
-
         return Task(
-            description=clean_surrogates(description),
+            name="research",
+            description=_CITY_RESEARCH_TEMPLATE.format(city=city),
             agent=agent,
-            expected_output=clean_surrogates(
+            expected_output=(
                 "Well-organized sections with clear headings (e.g., 'TOP 5 ATTRACTIONS', 'LOCAL CUISINE'), "
                 "using bullet points or numbered lists, and practical, actionable information "
                 "that helps travelers understand and navigate the destination effectively. "
@@ -272,71 +616,25 @@ class TripTasks:
         )
 
     def itinerary_creation_task(self, agent, inputs, city):
-        duration = inputs.get('duration', '3')
-        travel_type = inputs.get('travel_type', 'leisure')
-        interests = inputs.get('interests', 'general sightseeing')
-
-        description = f"""
-        Create a detailed {duration}-day itinerary for {city} based on:
-        - Travel Type: {travel_type}
-        - Interests: {interests}
-        - Duration: {duration} days
-        - Current location: Surat, Gujarat, India (Consider this for travel logistics if applicable, but focus on the destination city itself)
-
-        For each day, include:
-        1. DAY NUMBER: Clearly state the day (e.g., 'Day 1: Arrival and City Exploration')
-        2. Morning activities (9 AM - 12 PM) with specific attractions/locations
-        3. Afternoon activities (12 PM - 5 PM) with specific attractions/locations
-        4. Evening activities (5 PM - 9 PM) including recommendations for dinner/nightlife
-        5. Recommended restaurants for each meal (Breakfast, Lunch, Dinner) with type of cuisine
-        6. Estimated transportation methods between locations (e.g., 'walk', 'metro', 'taxi')
-        7. Estimated time for each activity
-        8. Any booking requirements or tips (e.g., 'Book in advance', 'Wear comfortable shoes')
-
-        Make sure activities are geographically logical, account for realistic travel time between locations,
-        and maximize the experience given the specified travel type and interests.
-        """
+        values = ChainMap({'city': city}, inputs, _ITINERARY_DEFAULTS)
 
         return Task(
-            description=clean_surrogates(description),
+            name="itinerary",
+            description=_ITINERARY_TEMPLATE.format_map(values),
             agent=agent,
-            expected_output=clean_surrogates(
-                f"A comprehensive day-by-day itinerary for {duration} days, clearly structured by day and time slots. "
+            expected_output=(
+                f"A comprehensive day-by-day itinerary for {values['duration']} days, clearly structured by day and time slots. "
                 "Each entry should include specific activities, recommended restaurants, transportation methods, "
                 "estimated timings, and practical tips, presented in a highly readable and actionable format."
             )
         )
 
     def budget_planning_task(self, agent, inputs, city):
-        budget_range = inputs.get('budget', 'moderate')
-        duration = inputs.get('duration', '3')
-        travel_type = inputs.get('travel_type', 'leisure')
-
-        description = f"""
-        Create a realistic budget plan for a {duration}-day trip to {city} assuming a {budget_range} budget.
-        Consider that the traveler is from Surat, Gujarat, India, which might influence spending habits or expectations.
-
-        Break down costs for the following categories:
-        1. ACCOMMODATION: Per night costs and total for {duration} nights. Provide options for the given budget.
-        2. MEALS: Daily averages for Breakfast, Lunch, Dinner. Provide typical costs for different meal types.
-        3. TRANSPORTATION: Local transport (daily passes, single rides), airport transfers (round trip), and potentially inter-city travel if applicable.
-        4. ATTRACTIONS: Entry fees for major sights and activities.
-        5. SHOPPING & MISCELLANEOUS: Estimated daily allowance for souvenirs, snacks, coffee, and small purchases.
-        6. EMERGENCY FUND: A recommended 10-15% buffer of the total estimated cost.
-
-        Provide:
-        - Daily budget estimates for each category.
-        - Total estimated budget for the entire {duration}-day trip.
-        - Money-saving tips specific to {city}.
-        - Splurge recommendations (e.g., a fancy dinner, unique experience) with estimated costs.
-
-        Use currency relevant to the destination city or provide a clear indication (e.g., USD, EUR, local currency).
-        """
-
         return Task(
-            description=clean_surrogates(description),
+            name="budget",
+            description=_BUDGET_TEMPLATE.format_map(ChainMap({'city': city}, inputs, _BUDGET_DEFAULTS)),
             agent=agent,
-            expected_output=clean_surrogates(
+            expected_output=(
                 "An itemized budget breakdown presented in a clear table or list format, "
                 "with daily and total estimated costs for each category (accommodation, meals, transport, etc.). "
                 "Include currency, money-saving tips, and optional splurge recommendations with price ranges."
@@ -345,119 +643,321 @@ class TripTasks:
 
 
 class TripCrew:
-    def __init__(self, inputs):
-        self.inputs = inputs
-        self.agents = TripAgents() # This will now raise an error if LLM init fails
+    """Runs the city selection, research, itinerary and budget stages for one trip.
+
+    By default every TripCrew shares the process-wide LLM from get_llm(); pass `llm` to
+    use a different one. With num_cities > 1, the top-ranked cities are planned in
+    parallel and each stage's output has one section per city.
+
+    run() creates new Agent instances on each call, so TripCrew objects built around
+    the same LLM can run concurrently; never reuse one run's agents in another.
+    """
+
+    def __init__(self, inputs, llm=None, num_cities=1):
+        # Clean user-provided values once here; the task templates themselves are plain ASCII
+        self.inputs = {key: clean_surrogates(value) for key, value in inputs.items()}
+        self.agents = TripAgents(llm) # This will now raise an error if LLM init fails
         self.tasks = TripTasks()
+        self.cache = get_response_cache()
+        self.semantic_cache = get_semantic_cache()
+        self.num_cities = num_cities
+
+    def _cache_key(self, tasks, city=None):
+        """Cache key covering the model settings, task descriptions, city and inputs"""
+        llm = self.agents.llm
+        return ResponseCache.make_key(
+            model=getattr(llm, "model", None),
+            temperature=getattr(llm, "temperature", None),
+            max_tokens=getattr(llm, "max_tokens", None),
+            tasks=[task.description for task in tasks],
+            city=city,
+            inputs=self.inputs,
+        )
 
-    def extract_first_city(self, city_output):
-        """Extract the first city from the city selection output"""
+    def _semantic_query(self):
+        """The exact-match scope and the interests text used for semantic cache lookups"""
+        llm = self.agents.llm
+        scope = ResponseCache.make_key(
+            model=getattr(llm, "model", None),
+            temperature=getattr(llm, "temperature", None),
+            max_tokens=getattr(llm, "max_tokens", None),
+            num_cities=self.num_cities,
+            travel_type=self.inputs.get("travel_type"),
+            season=self.inputs.get("season"),
+            duration=self.inputs.get("duration"),
+            budget=self.inputs.get("budget"),
+        )
+        return scope, str(self.inputs.get("interests", ""))
+
+    def _cached_kickoff(self, key, kickoff):
+        """Return the cached outputs for key, or run kickoff() and cache its outputs"""
+        if self.cache is None:
+            return kickoff()
+        cached = self.cache.get(key)
+        if cached is not None:
+            print("⚡ Using cached LLM output")
+            return cached
+        outputs = kickoff()
+        self.cache.set(key, outputs, model=getattr(self.agents.llm, "model", None))
+        return outputs
+
+    async def _kickoff_concurrently(self, tasks):
+        """Kick off a single-agent Crew per task at once and return raw outputs keyed by task name.
+
+        The research, itinerary and budget tasks only depend on the selected city, so
+        running them as separate crews turns their latency from the sum into the max.
+        CrewAI's kickoff is blocking, so each one runs in a worker thread.
+
+        If one stage fails, its error is raised right away. Kickoffs already in flight
+        cannot be interrupted and run to completion in the background; their results
+        are discarded.
+        """
+        crews = {
+            task.name: Crew(
+                agents=[task.agent],
+                tasks=[task],
+                verbose=VERBOSE,
+                full_output=True
+            )
+            for task in tasks
+        }
+        # Kickoffs run on an executor owned here rather than the loop's default one, which
+        # asyncio.run would wait for on exit; on failure it is dropped without waiting
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=len(crews))
+
+        async def kickoff(crew):
+            return await loop.run_in_executor(executor, call_with_retry, crew.kickoff)
+
+        try:
+            async with asyncio.TaskGroup() as group:
+                runs = {kind: group.create_task(kickoff(crew)) for kind, crew in crews.items()}
+        except ExceptionGroup as errors:
+            raise errors.exceptions[0] from errors
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        results = {kind: run.result() for kind, run in runs.items()}
+        return {
+            kind: result.raw if hasattr(result, 'raw') else str(result)
+            for kind, result in results.items()
+        }
+
+    @staticmethod
+    def _is_valid_city(city):
+        """Filter out common non-city words or partial matches"""
+        city_lower = city.lower()
+        return (len(city) > 2 and
+                not city_lower.startswith(_EXCLUDED_PREFIXES) and
+                not city_lower.endswith('city')) # Exclude generic "city"
+
+    @classmethod
+    def _city_in_entry(cls, entry):
+        """(label, city) from a numbered entry's text, where label is set for "Label: City" entries.
+
+        city is None when the entry doesn't name a valid city.
+        """
+        match = _CITY_NAME_RE.match(entry)
+        if match and cls._is_valid_city(match.group(1).strip()):
+            return None, match.group(1).strip()
+        # Echoes of the task layout, e.g. "1. City name and country: Barcelona, Spain"
+        label, colon, rest = entry.partition(":")
+        if colon:
+            match = _CITY_NAME_RE.match(rest.strip(" \t*"))
+            if match and cls._is_valid_city(match.group(1).strip()):
+                return label.strip(" \t*"), match.group(1).strip()
+        return None, None
+
+    def _numbered_cities(self, text, k):
+        """Up to k cities from the top-level numbered entries of text, or None without a numbered list.
+
+        If the first entry names no city, later entries are not promoted to cities: they
+        are details such as "2. Why it matches: ...". In a "Label: City" list only entries
+        with the first entry's label count.
+        """
+        entries = [(len(match.group(1)), match.group(2)) for match in _CITY_NUMBERED_RE.finditer(text)]
+        if not entries:
+            return None
+        # Details nested under each city are indented deeper than the cities themselves
+        top_level = min(indent for indent, _ in entries)
+        entries = [entry for indent, entry in entries if indent == top_level]
+
+        label, first_city = self._city_in_entry(entries[0])
+        if first_city is None:
+            return []
+        cities = [first_city]
+        for entry in entries[1:]:
+            if len(cities) == k:
+                break
+            entry_label, city = self._city_in_entry(entry)
+            if city is not None and entry_label == label and city not in cities:
+                cities.append(city)
+        return cities
+
+    def _first_numbered_city(self, partial_output):
+        """The first numbered city of a partial selector output, from complete lines only"""
+        cities = self._numbered_cities(partial_output[:partial_output.rfind("\n") + 1], k=1)
+        return cities[0] if cities else None
+
+    def _stream_city_selection(self, agent, task, on_first_city):
+        """Run city selection as one streamed completion with the agent's persona.
+
+        Calls on_first_city(city) as soon as the first numbered city has streamed in, so
+        detailed planning can start while cities 2 and 3 are still being generated.
+        """
+        messages = [
+            {"role": "system", "content": f"You are {agent.role}. {agent.backstory}\nYour personal goal is: {agent.goal}"},
+            {"role": "user", "content": f"{task.description}\n\nThis is the expected criteria for your final answer: {task.expected_output}"},
+        ]
+        stream = call_with_retry(
+            lambda: litellm.completion(messages=messages, stream=True, **completion_params(self.agents.llm))
+        )
+
+        output = ""
+        first_city = None
+        for chunk in stream:
+            output += chunk.choices[0].delta.content or ""
+            if first_city is None:
+                first_city = self._first_numbered_city(output)
+                if first_city:
+                    on_first_city(first_city)
+        return output
+
+    def _stage_tasks(self, city):
+        """Fresh research, itinerary and budget tasks for city, each with its own agent"""
+        return [
+            self.tasks.city_research_task(self.agents.local_expert_agent(), city),
+            self.tasks.itinerary_creation_task(self.agents.travel_planner_agent(), self.inputs, city),
+            self.tasks.budget_planning_task(self.agents.budget_manager_agent(), self.inputs, city),
+        ]
+
+    def _plan_city(self, city):
+        """Research, itinerary and budget outputs for city, keyed by stage"""
+        tasks = self._stage_tasks(city)
+        return self._cached_kickoff(
+            self._cache_key(tasks, city),
+            lambda: asyncio.run(self._kickoff_concurrently(tasks))
+        )
+
+    def _valid_cities(self, candidates, k):
+        """The first k distinct valid cities among candidates"""
+        cities = []
+        for candidate in candidates:
+            city = candidate.strip()
+            if self._is_valid_city(city) and city not in cities:
+                cities.append(city)
+                if len(cities) == k:
+                    break
+        return cities
+
+    def extract_cities(self, city_output, k=3):
+        """Extract up to k distinct cities from the city selection output, in ranked order"""
         if isinstance(city_output, dict):
             city_output = str(city_output)
 
         # Clean the output first
         city_output = clean_surrogates(city_output)
 
-        # Try different patterns to extract city names
-        patterns = [
-            r"1\.\s*([A-Z][a-zA-Z\s]+?)(?:,\s*[A-Z][a-zA-Z\s]+?|\s*[-,:]|\n)",  # "1. Paris, France" or "1. New York"
-            r"[-*•]\s*([A-Z][a-zA-Z\s]+?)(?:,\s*[A-Z][a-zA-Z\s]+?|\s*[-,:]|\n)",  # Bullet points
-            r"(\b[A-Z][a-zA-Z\s]+?)(?:\s*[-,:])",  # City names followed by punctuation
-            r"([A-Z][a-zA-Z\s]{3,25})"  # Any capitalized words (cities), minimum 3 letters
-        ]
+        # Numbered list first; bullets only when there is no numbered list at all
+        cities = self._numbered_cities(city_output, k)
+        if cities is None:
+            cities = self._valid_cities((match.group(1) for match in _CITY_BULLET_RE.finditer(city_output)), k)
+        if not cities:
+            # No city in a list; fall back to the looser patterns
+            cities = self._valid_cities(
+                (match.group(1) for pattern in _CITY_FALLBACK_PATTERNS for match in pattern.finditer(city_output)),
+                k
+            )
 
-        for pattern in patterns:
-            matches = re.findall(pattern, city_output)
-            if matches:
-                for match in matches:
-                    city = match.strip()
-                    # Filter out common non-city words or partial matches
-                    excluded_words = ['the', 'and', 'for', 'with', 'city', 'travel', 'trip', 'based', 'type', 'perfect', 'best', 'experience', 'plan', 'planning', 'expert', 'reasons', 'selection']
-                    if (len(city) > 2 and
-                        city.lower() not in excluded_words and
-                        not any(city.lower().startswith(ew) for ew in excluded_words) and
-                        not city.lower().endswith('city')): # Exclude generic "city"
-                        print(f"DEBUG: Extracted potential city: {city}")
-                        return city
-
-        # Default fallback
-        print("⚠️ Could not extract a valid city from output, using default: Paris")
-        return "Paris"
+        if cities:
+            print(f"DEBUG: Extracted potential cities: {', '.join(cities)}")
+        else:
+            # Default fallback
+            print("⚠️ Could not extract a valid city from output, using default: Paris")
+            cities.append("Paris")
+        return cities
+
+    def extract_first_city(self, city_output):
+        """Extract the first city from the city selection output"""
+        return self.extract_cities(city_output, k=1)[0]
 
     def run(self):
         try:
+            if self.semantic_cache is not None:
+                semantic_scope, semantic_text = self._semantic_query()
+                cached_plan = self.semantic_cache.get(semantic_scope, semantic_text)
+                if cached_plan is not None:
+                    print("⚡ Using cached plan for a similar trip")
+                    return cached_plan
+
             print("🌍 Starting city selection...")
 
             # Step 1: City Selection
             selector = self.agents.city_selector_agent()
             city_task = self.tasks.city_selection_task(selector, self.inputs)
 
-            city_crew = Crew(
-                agents=[selector],
-                tasks=[city_task],
-                verbose=True,
-                full_output=True # Ensures we get a detailed output object
-            )
-
-            city_result_object = city_crew.kickoff()
+            # Detailed planning for the first streamed city starts in the background. One
+            # spare worker lets the real cities start even if an early dispatch turns out to
+            # be for a city that was not selected.
+            plans = {}
+            executor = ThreadPoolExecutor(max_workers=self.num_cities + 1)
+            try:
+                def plan_early(city):
+                    print(f"🚀 Starting detailed planning for {city} while city selection finishes...")
+                    plans[city] = executor.submit(self._plan_city, city)
 
-            # Ensure we get the raw string content for extraction
-            city_output_raw = city_result_object.raw if hasattr(city_result_object, 'raw') else str(city_result_object.result)
-            print(f"City selection raw output: {city_output_raw}")
+                def select_cities():
+                    try:
+                        return self._stream_city_selection(selector, city_task, plan_early)
+                    except Exception as e:
+                        print(f"⚠️ Streaming city selection failed ({e}), falling back to the crew...")
+
+                    city_crew = Crew(
+                        agents=[selector],
+                        tasks=[city_task],
+                        verbose=VERBOSE,
+                        full_output=True # Ensures we get a detailed output object
+                    )
 
-            # Extract selected city
-            selected_city = self.extract_first_city(city_output_raw)
-            print(f"✅ Selected city for detailed planning: {selected_city}")
+                    city_result_object = call_with_retry(city_crew.kickoff)
 
-            # Step 2: Research, Itinerary, and Budget Planning
-            print(f"🔍 Researching {selected_city}...")
+                    # Ensure we get the raw string content for extraction
+                    return city_result_object.raw if hasattr(city_result_object, 'raw') else str(city_result_object.result)
 
-            researcher = self.agents.local_expert_agent()
-            planner = self.agents.travel_planner_agent()
-            budgeter = self.agents.budget_manager_agent()
+                city_output_raw = self._cached_kickoff(self._cache_key([city_task]), select_cities)
+                print(f"City selection raw output: {city_output_raw}")
 
-            research_task = self.tasks.city_research_task(researcher, selected_city)
-            itinerary_task = self.tasks.itinerary_creation_task(planner, self.inputs, selected_city)
-            budget_task = self.tasks.budget_planning_task(budgeter, self.inputs, selected_city)
+                # Extract selected cities
+                selected_cities = self.extract_cities(city_output_raw, k=self.num_cities)
+                print(f"✅ Selected cities for detailed planning: {', '.join(selected_cities)}")
 
-            trip_crew = Crew(
-                agents=[researcher, planner, budgeter],
-                tasks=[research_task, itinerary_task, budget_task],
-                verbose=True,
-                full_output=True # Again, ensure full output
-            )
+                # Step 2: Research, Itinerary, and Budget Planning, each city in its own worker
+                for city in selected_cities:
+                    if city not in plans:
+                        print(f"🔍 Researching {city}...")
+                        plans[city] = executor.submit(self._plan_city, city)
+                details = {city: plans[city].result() for city in selected_cities}
+            finally:
+                # Don't wait for an unused early plan; its worker finishes in the background
+                executor.shutdown(wait=False, cancel_futures=True)
 
-            detailed_results_object = trip_crew.kickoff()
-
-            # Extract results properly from tasks_output
-            city_research_output = "No research available"
-            itinerary_output = "No itinerary available"
-            budget_output = "No budget available"
-
-            if hasattr(detailed_results_object, 'tasks_output') and detailed_results_object.tasks_output:
-                for task_result in detailed_results_object.tasks_output:
-                    if "research" in task_result.description.lower(): # Crude check for research task
-                        city_research_output = task_result.raw if hasattr(task_result, 'raw') else str(task_result)
-                    elif "itinerary" in task_result.description.lower(): # Crude check for itinerary task
-                        itinerary_output = task_result.raw if hasattr(task_result, 'raw') else str(task_result)
-                    elif "budget" in task_result.description.lower(): # Crude check for budget task
-                        budget_output = task_result.raw if hasattr(task_result, 'raw') else str(task_result)
-            else:
-                 # Fallback if tasks_output is not structured as expected
-                print("WARNING: 'tasks_output' not found as expected. Attempting string parsing fallback.")
-                result_str = str(detailed_results_object.result if hasattr(detailed_results_object, 'result') else detailed_results_object)
-                # This parsing is less reliable but better than nothing
-                city_research_output = result_str
-                itinerary_output = result_str
-                budget_output = result_str
+            def stage_output(kind):
+                if len(details) == 1:
+                    return next(iter(details.values()))[kind]
+                return "\n\n---\n\n".join(f"## {city}\n\n{plan[kind]}" for city, plan in details.items())
 
+            city_research_output = stage_output("research")
+            itinerary_output = stage_output("itinerary")
+            budget_output = stage_output("budget")
 
-            return {
+            plan = {
                 "🌆 City Selection": clean_surrogates(city_output_raw),
                 "🗺 City Research": clean_surrogates(city_research_output),
                 "📅 Itinerary": clean_surrogates(itinerary_output),
                 "💸 Budget Plan": clean_surrogates(budget_output)
             }
+            if self.semantic_cache is not None:
+                self.semantic_cache.set(semantic_scope, semantic_text, plan)
+            return plan
 
         except Exception as e:
             print(f"❌ Error in TripCrew.run(): {e}")